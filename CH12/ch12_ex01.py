@@ -6,9 +6,17 @@ import re
 import random
 import glob
 import gzip
-from collections import namedtuple, Counter
-from datetime import datetime
-from urllib.parse import urlparse
+import hashlib
+import heapq
+import math
+import queue
+import threading
+import time
+import timeit
+from collections import namedtuple, Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache, partial
+from urllib.parse import urlparse, ParseResult
 from itertools import filterfalse
 
 ###########################################
@@ -93,6 +101,94 @@ def read_gzip_file(zip_file):
 def read_gzip_files_2(pattern):
     map(read_gzip_file, glob.glob(pattern))
 
+# A pipelined implementation of read_gzip_files() 
+
+# zlib releases the GIL while it decompresses, so decompression can 
+# overlap with parsing. A background thread reads large blocks, 
+# finishes each block's last line with readline(), and puts batches 
+# of lines into a bounded queue. The queue size limits the memory used.
+# The timings Counter reports where each side spent its time:
+# * 'decompress' is the time spent reading and decompressing blocks.
+# * 'reader_wait' is the time the reader waited on a full queue; 
+# a large value means parsing is the bottleneck.
+# * 'parser_wait' is the time the parser waited on an empty queue; 
+# a large value means decompression is the bottleneck.
+
+def put_batch(batches, stop, item):
+    while not stop.is_set():
+        try:
+            batches.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def split_block(block):
+    lines = block.decode('us-ascii').split('\n')
+    if not lines[-1]:
+        lines.pop()
+    return [line.rstrip() for line in lines]
+
+# The read_gzip_blocks() function reads a fixed-size block and then 
+# finishes the partial line at the end of it with readline(), 
+# so no line is ever split between two blocks:
+
+def read_gzip_blocks(zip_file, block_size):
+    with gzip.open(zip_file, "rb") as fh:
+        while True:
+            block = fh.read(block_size)
+            if not block:
+                break
+            yield block + fh.readline()
+
+def decompress_batches(zip_file, batches, stop, timings, block_size):
+    try:
+        blocks = read_gzip_blocks(zip_file, block_size)
+        while True:
+            start = time.perf_counter()
+            block = next(blocks, None)
+            timings['decompress'] += time.perf_counter() - start
+            if block is None:
+                break
+            lines = split_block(block)
+            start = time.perf_counter()
+            if not put_batch(batches, stop, lines):
+                blocks.close()
+                return
+            timings['reader_wait'] += time.perf_counter() - start
+    except Exception as error:
+        put_batch(batches, stop, error)
+        return
+    put_batch(batches, stop, None)
+
+def read_gzip_file_pipelined(zip_file, timings, block_size, queue_size):
+    batches = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    reader = threading.Thread(
+        target=decompress_batches, 
+        args=(zip_file, batches, stop, timings, block_size),
+        daemon=True
+        )
+    reader.start()
+    try:
+        while True:
+            start = time.perf_counter()
+            lines = batches.get()
+            timings['parser_wait'] += time.perf_counter() - start
+            if lines is None:
+                break
+            if isinstance(lines, Exception):
+                raise lines
+            yield from lines
+    finally:
+        stop.set()
+        reader.join()
+
+def read_gzip_files_pipelined(pattern, timings, block_size=2**20, queue_size=8):
+    zip_logs = glob.glob(pattern)
+    for zip_file in zip_logs:
+        yield read_gzip_file_pipelined(zip_file, timings, block_size, queue_size)
+
 
 #---------------
 # Parsing log lines into namedtuples
@@ -143,6 +239,59 @@ def convert_to_access_tuples(iterable):
         (line for logfile in iterable for line in logfile)
         )
 
+#---------------
+# Parsing log lines as bytes
+#---------------
+
+# Decoding every line and building a dict with groupdict() 
+# are most of the cost of the parsing loop. 
+# We can match the raw bytes instead, with a bytes regular expression 
+# that uses positional groups in the same order as the Access fields:
+
+formatPatternBytes = re.compile(
+    rb"([\d\.]+)\s+"
+    rb"(\S+)\s+"
+    rb"(\S+)\s+"
+    rb"\[(.+?)\]\s+"
+    rb'"(.+?)"\s+'
+    rb"(\d+)\s+"
+    rb"(\S+)\s+"
+    rb'"(.+?)"\s*'
+)
+
+# The AccessBytes namedtuple holds the matched bytes, 
+# and each field is decoded to str only when a later stage reads it:
+
+def decoded_field(index):
+    return property(
+        lambda access: tuple.__getitem__(access, index).decode('us-ascii')
+        )
+
+class AccessBytes(namedtuple('AccessBytes', Access._fields)):
+    __slots__ = ()
+
+for index, name in enumerate(Access._fields):
+    setattr(AccessBytes, name, decoded_field(index))
+
+# The read_gzip_files_bytes() function yields each file 
+# as an iterator over its undecoded lines:
+
+def read_gzip_files_bytes(pattern):
+    zip_logs = glob.glob(pattern)
+    for zip_file in zip_logs:
+        with gzip.open(zip_file, "rb") as fh:
+            yield fh
+
+# And the convert_to_access_tuples_bytes() function builds 
+# each AccessBytes directly from match.groups():
+
+def convert_to_access_tuples_bytes(iterable):
+    for logfile in iterable:
+        for line in logfile:
+            match = formatPatternBytes.match(line)
+            if match:
+                yield AccessBytes._make(match.groups())
+
 #---------------
 # Parsing additional fields of an Access object
 #---------------
@@ -199,28 +348,244 @@ def convert_to_accessdetail_tuples(iterable):
         except ValueError as e:
             print(e, repr(access))
 
-# An alternative implementation of convert_to_accessdetail_tuples() 
-
-def convert_to_accessdetail_tuple(access):
+# Printing every rejected line is slow on dirty logs, where it can mean 
+# hundreds of thousands of writes to stdout. Instead, the rejections 
+# can be collected in a Rejections object: a Counter of the error classes, 
+# and a bounded random sample of the rejected records. 
+# The sample is a reservoir: each of the rejections seen so far 
+# has the same chance of being in it.
+
+Rejected = namedtuple('Rejected', ['error', 'record'])
+
+class Rejections:
+    __slots__ = ('size', 'counts', 'seen', 'sample')
+
+    def __init__(self, size=100):
+        self.size = size
+        self.counts = Counter()
+        self.seen = 0
+        self.sample = []
+
+    def add(self, error, record):
+        self.counts[type(error).__name__] += 1
+        self.seen += 1
+        if len(self.sample) < self.size:
+            self.sample.append(Rejected(str(error), record))
+        else:
+            index = random.randrange(self.seen)
+            if index < self.size:
+                self.sample[index] = Rejected(str(error), record)
+
+# An alternative implementation of convert_to_accessdetail_tuples(), 
+# which records rejections instead of printing them. 
+# Without a Rejections object, rejected records are dropped silently:
+
+def convert_to_accessdetail_tuple(access, rejections=None):
     try:
         meth, uri, protocol = parse_request(access.request)
         return AccessDetails(
             access = access,
             time = parse_time(access.time),
             method = meth,
-            url = urlparse(uri),
+            url = parse_url(uri),
             protocol = protocol,
             agent = parse_agent(access.user_agent)
         )
     except ValueError as e:
-        print(e, repr(access))
+        if rejections is not None:
+            rejections.add(e, access)
 
-def convert_to_accessdetail_tuples(iterable):
+def convert_to_accessdetail_tuples(iterable, rejections=None):
     return filter(
         None, 
-        map(convert_to_accessdetail_tuple, iterable)
+        map(
+            partial(convert_to_accessdetail_tuple, rejections=rejections), 
+            iterable
+            )
         )
 
+#---------------
+# Parsing timestamps without strptime()
+#---------------
+
+# The strptime() function interprets its format string on every call.
+# A CLF timestamp always has the same layout, '01/Jun/2012:22:17:54 -0400', 
+# so each field can be sliced out at a fixed offset instead. 
+# The month names are looked up in a table:
+
+MONTHS = {
+    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6, 
+    'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12,
+}
+
+# A log usually has only a handful of distinct offsets, 
+# so one tzinfo object is built per offset and reused:
+
+@lru_cache(maxsize=None)
+def parse_timezone(offset):
+    sign = -1 if offset[0] == '-' else 1
+    return timezone(
+        sign*timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5]))
+        )
+
+# Under load the same second-resolution timestamp appears on many 
+# consecutive lines, so a small cache of recent timestamps 
+# skips even the slicing:
+
+# The separators, the sign of the offset and the digits are checked 
+# first, so anything strptime() would reject raises ValueError here too:
+
+CLF_SEPARATORS = ((2, '/'), (6, '/'), (11, ':'), (14, ':'), (17, ':'), (20, ' '))
+
+def is_clf_timestamp(ts):
+    digits = ts[0:2] + ts[7:11] + ts[12:14] + ts[15:17] + ts[18:20] + ts[22:26]
+    return (
+        len(ts) == 26 
+        and all(ts[i] == c for i, c in CLF_SEPARATORS)
+        and ts[3:6] in MONTHS
+        and ts[21] in '+-'
+        and digits.isascii() and digits.isdigit()
+        and ts[24:26] < '60'
+        )
+
+@lru_cache(maxsize=128)
+def parse_time_fast(ts):
+    if not is_clf_timestamp(ts):
+        raise ValueError("time data {0!r} is not a CLF timestamp".format(ts))
+    return datetime(
+        int(ts[7:11]), MONTHS[ts[3:6]], int(ts[0:2]), 
+        int(ts[12:14]), int(ts[15:17]), int(ts[18:20]), 
+        tzinfo = parse_timezone(ts[21:26])
+        )
+
+# The fast parser replaces parse_time() in the pipeline. 
+# The strptime() version is kept for comparison:
+
+parse_time_strptime = parse_time
+parse_time = parse_time_fast
+
+# The benchmark_parse_time() function compares the three variants 
+# on the timestamps of a log file:
+
+def benchmark_parse_time(pattern='../example.log.gz', number=1000):
+    timestamps = [
+        access.time 
+        for access in convert_to_access_tuples(read_gzip_files(pattern))
+        if access
+        ]
+    variants = (
+        ('strptime', parse_time_strptime),
+        ('slicing', parse_time_fast.__wrapped__),
+        ('slicing+cache', parse_time_fast),
+    )
+    for name, parser in variants:
+        seconds = timeit.timeit(
+            lambda: list(map(parser, timestamps)), number=number
+            )
+        print(name, seconds)
+
+#---------------
+# Caching the user agent details
+#---------------
+
+# Real traffic has a few thousand distinct user agents spread over 
+# millions of lines. A bounded LRU cache keyed on the raw user agent 
+# string returns the same shared AgentDetails object for each repeat. 
+# Since AgentDetails is immutable, sharing it is safe.
+
+def make_agent_parser(maxsize=4096):
+    return lru_cache(maxsize=maxsize)(parse_agent_uncached)
+
+parse_agent_uncached = parse_agent
+
+# The current cache is kept in a dict, and parse_agent() looks it up 
+# on every call. Modules that imported parse_agent by name 
+# use the new cache after a resize:
+
+agentCache = {'parser': make_agent_parser()}
+
+def parse_agent(user_agent):
+    return agentCache['parser'](user_agent)
+
+# The size can be changed at runtime. The hits and misses counters 
+# reported by agent_cache_info() show whether the size is right:
+
+def set_agent_cache_size(maxsize):
+    agentCache['parser'] = make_agent_parser(maxsize)
+
+def agent_cache_info():
+    return agentCache['parser'].cache_info()
+
+'''
+>>> agent_cache_info()
+CacheInfo(hits=..., misses=..., maxsize=4096, currsize=...)
+'''
+
+#---------------
+# Splitting request targets without urlparse()
+#---------------
+
+# The urlparse() function handles every form of URL, but almost every 
+# request target in a log is a path like '/book/index.html?page=2'. 
+# For a target that starts with a single slash there's no scheme 
+# and no netloc, so the same split that urlparse() does can be done 
+# with a few partition() calls. Like urlparse(), the params after a ';' 
+# in the last path item are split off:
+
+def split_params(path):
+    index = path.find(';', path.rfind('/'))
+    if index < 0:
+        return path, ''
+    return path[:index], path[index+1:]
+
+def split_target(uri):
+    path, _, fragment = uri.partition('#')
+    path, _, query = path.partition('?')
+    path, params = split_params(path)
+    return ParseResult('', '', path, params, query, fragment)
+
+# Any other target goes to urlparse(), so a ValueError is still raised 
+# inside convert_to_accessdetail_tuple(). Either way the result is 
+# a ParseResult. Repeated targets are served from a bounded cache:
+
+@lru_cache(maxsize=4096)
+def parse_url(uri):
+    if uri[:1] == '/' and uri[1:2] != '/':
+        return split_target(uri)
+    return urlparse(uri)
+
+# The check_parse_url() function compares the result with urlparse() 
+# for every request in a log, and returns the targets that differ:
+
+def check_parse_url(pattern='../example.log.gz'):
+    uris = (
+        parse_request(access.request)[1]
+        for access in convert_to_access_tuples(read_gzip_files(pattern))
+        if access
+        )
+    return [
+        uri 
+        for uri in uris 
+        if parse_url.__wrapped__(uri) != urlparse(uri)
+        ]
+
+def benchmark_parse_url(pattern='../example.log.gz', number=1000):
+    uris = [
+        parse_request(access.request)[1]
+        for access in convert_to_access_tuples(read_gzip_files(pattern))
+        if access
+        ]
+    variants = (
+        ('urlparse', lambda uri: urlparse(uri).path),
+        ('split_target', lambda uri: split_target(uri).path),
+        ('parse_url', lambda uri: parse_url(uri).path),
+    )
+    for name, variant in variants:
+        seconds = timeit.timeit(
+            lambda: list(map(variant, uris)), number=number
+            )
+        print(name, seconds)
+
 #---------------
 # Filtering the access details
 #---------------
@@ -272,14 +637,89 @@ def remove_fields_2(iterable):
         yield detail
 
 # Another alternative implementation of remove_fields() 
+# The predicates work on the list of path items, so each one 
+# is applied to the split path of a detail:
+
+def on_path(predicate):
+    return lambda detail: predicate(detail.url.path.split('/'))
 
 def remove_fields_3(iterable):    
     return \
-        filterfalse(arethere_excluded_extensions, \
-        filterfalse(arethere_excluded_names,\
-        filter(is_nonempty_path, iterable)
+        filterfalse(on_path(lambda path: arethere_excluded_extensions(path[-1])), \
+        filterfalse(on_path(arethere_excluded_names),\
+        filter(on_path(is_nonempty_path), iterable)
         ))
 
+# A compiled implementation of remove_fields() 
+
+# All three variants split the path, and create generators or extra 
+# function calls for every detail. The three rules can be compiled 
+# once into a single regular expression that must match the whole path:
+# * A path with no non-empty items is all slashes.
+# * Otherwise, after any number of leading items, either an excluded 
+# name is a whole item, or the final item ends with an excluded extension.
+
+# An empty set of names or extensions leaves out its rule, 
+# since an empty alternation would match every path:
+
+def compile_exclusions(names, extensions):
+    rules = []
+    if names:
+        rules.append(
+            r"(?:" + '|'.join(map(re.escape, sorted(names))) + r")(?:/.*)?"
+            )
+    if extensions:
+        rules.append(
+            r"[^/]*(?:" + '|'.join(map(re.escape, sorted(extensions))) + r")"
+            )
+    pattern = r"/*"
+    if rules:
+        pattern += r"|(?:[^/]*/)*(?:" + '|'.join(rules) + r")"
+    return re.compile(pattern, re.DOTALL)
+
+excludedPattern = compile_exclusions(excludedNames, excludedExtensions)
+
+def remove_fields_4(iterable):
+    return (
+        detail 
+        for detail in iterable 
+        if not excludedPattern.fullmatch(detail.url.path)
+        )
+
+# Names and extensions can be added at runtime; 
+# the pattern is compiled again each time:
+
+def exclude_names(*names):
+    global excludedPattern
+    excludedNames.update(names)
+    excludedPattern = compile_exclusions(excludedNames, excludedExtensions)
+
+def exclude_extensions(*extensions):
+    global excludedPattern
+    excludedExtensions.update(extensions)
+    excludedPattern = compile_exclusions(excludedNames, excludedExtensions)
+
+# The benchmark_remove_fields() function compares the four variants 
+# on the details of a log file:
+
+def benchmark_remove_fields(pattern='../example.log.gz', number=1000):
+    details = list(
+        convert_to_accessdetail_tuples(\
+        convert_to_access_tuples(\
+        read_gzip_files(pattern)
+        )))
+    variants = (
+        ('remove_fields', remove_fields),
+        ('remove_fields_2', remove_fields_2),
+        ('remove_fields_3', remove_fields_3),
+        ('remove_fields_4', remove_fields_4),
+    )
+    for name, variant in variants:
+        seconds = timeit.timeit(
+            lambda: list(variant(details)), number=number
+            )
+        print(name, seconds)
+
 #---------------
 # Analyzing the access details
 #---------------
@@ -291,13 +731,21 @@ AccessDetails objects.
 # The filter_books() function will pass only specific paths, 
 # Here is the filter_books() function:
 
+bookItem = 'book'
+
 def isthere_book_in_path(detail):
     paths = tuple(
         item 
         for item in detail.url.path.split('/') 
         if item
         )
-    return paths[0] == 'book' and len(paths) > 1
+    return paths[0] == bookItem and len(paths) > 1
+
+# A path whose first non-empty item is bookItem, followed by at least 
+# one more item, always contains bookItem + '/'. The prefilter below 
+# uses this required substring, so it's built from the same constant:
+
+isthere_book_in_path.required = bookItem + '/'
 
 def filter_books(iterable):
     return filter(isthere_book_in_path, iterable)
@@ -311,6 +759,317 @@ def reduce_book_total(iterable):
         counts[detail.url.path] += 1
     return counts
 
+#---------------
+# Computing several aggregates in one pass
+#---------------
+
+# Each report on a dashboard needs a different reduction of the same 
+# AccessDetails stream. Rather than reparsing the logs for each one, 
+# we can describe every reduction as a namedtuple of four functions:
+# * initial() creates an empty accumulator.
+# * update(accumulator, detail) adds one detail, and returns the accumulator.
+# * merge(accumulator, accumulator) combines two partial results, 
+# such as the results of two workers in a pool.
+# * result(accumulator) produces the final value of the report.
+
+Reducer = namedtuple('Reducer', ['initial', 'update', 'merge', 'result'])
+
+# Here are the reducers for counts, sums, top-K and distinct counts 
+# by some key:
+
+def merge_counters(left, right):
+    left.update(right)
+    return left
+
+def count_by(key):
+    def update(counts, detail):
+        counts[key(detail)] += 1
+        return counts
+    return Reducer(Counter, update, merge_counters, dict)
+
+def sum_by(key, value):
+    def update(sums, detail):
+        sums[key(detail)] += value(detail)
+        return sums
+    return Reducer(Counter, update, merge_counters, dict)
+
+def top_k(key, k):
+    return count_by(key)._replace(
+        result = lambda counts: counts.most_common(k)
+        )
+
+def merge_sets(left, right):
+    for name, values in right.items():
+        left[name] |= values
+    return left
+
+def distinct_by(key, value):
+    def update(distinct, detail):
+        distinct[key(detail)].add(value(detail))
+        return distinct
+    return Reducer(
+        lambda: defaultdict(set), update, merge_sets, 
+        lambda distinct: {name: len(values) for name, values in distinct.items()}
+        )
+
+# The when() function restricts a reducer to the details 
+# that pass a predicate:
+
+def when(predicate, reducer):
+    def update(accumulator, detail):
+        if predicate(detail):
+            return reducer.update(accumulator, detail)
+        return accumulator
+    return reducer._replace(update = update)
+
+# Some keys for the reports:
+
+def get_path(detail):
+    return detail.url.path
+
+def get_status(detail):
+    return detail.access.status
+
+def get_host(detail):
+    return detail.access.host
+
+def get_hour(detail):
+    return detail.time.replace(minute=0, second=0)
+
+def get_bytes(detail):
+    size = detail.access.bytes
+    return int(size) if size.isdigit() else 0
+
+# The registry of reports is a dict of reducers. 
+# A new report is registered by adding an entry to it:
+
+dashboardReducers = {
+    'books': when(isthere_book_in_path, count_by(get_path)),
+    'status': count_by(get_status),
+    'top_hosts': top_k(get_host, 10),
+    'hourly': count_by(get_hour),
+    'bytes': sum_by(get_path, get_bytes),
+    'hourly_hosts': distinct_by(get_hour, get_host),
+}
+
+# The reduce_all() function feeds every detail to every reducer:
+
+def reduce_all(reducers, iterable):
+    accumulators = {name: reducer.initial() for name, reducer in reducers.items()}
+    for detail in iterable:
+        for name, reducer in reducers.items():
+            accumulators[name] = reducer.update(accumulators[name], detail)
+    return accumulators
+
+def merge_all(reducers, left, right):
+    return {
+        name: reducer.merge(left[name], right[name]) 
+        for name, reducer in reducers.items()
+        }
+
+def finish_all(reducers, accumulators):
+    return {
+        name: reducer.result(accumulators[name]) 
+        for name, reducer in reducers.items()
+        }
+
+#---------------
+# Counting heavy hitters in bounded memory
+#---------------
+
+# The Counter in reduce_book_total() keeps one entry for every distinct 
+# path. Crawlers that generate unique paths can push that to millions 
+# of entries, and a pool has to pickle all of them back to the parent.
+
+# The HeavyHitters class is a Misra-Gries summary with a fixed capacity. 
+# It keeps at most 2*capacity counters. When it outgrows that, it 
+# subtracts the (capacity+1)-th largest count from every counter and 
+# drops the ones that fall to zero. The error bounds are:
+# * Each reported count is a lower bound: 
+# count <= true count <= count + error.
+# * error <= total/(capacity+1), where total is the number of items seen.
+# * Any key whose true count is more than error is always reported.
+# Merging two summaries keeps the same bounds for the combined total, 
+# so partial results from workers can be merged in any order.
+
+class HeavyHitters:
+    __slots__ = ('capacity', 'counts', 'total', 'error')
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts = Counter()
+        self.total = 0
+        self.error = 0
+
+    def update(self, key):
+        self.counts[key] += 1
+        self.total += 1
+        if len(self.counts) > 2*self.capacity:
+            self.prune()
+        return self
+
+    def prune(self):
+        if len(self.counts) <= self.capacity:
+            return
+        threshold = heapq.nlargest(self.capacity+1, self.counts.values())[-1]
+        self.counts = Counter({
+            key: count - threshold 
+            for key, count in self.counts.items() 
+            if count > threshold
+            })
+        self.error += threshold
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        self.total += other.total
+        self.error += other.error
+        if len(self.counts) > 2*self.capacity:
+            self.prune()
+        return self
+
+    def most_common(self, n=None):
+        return self.counts.most_common(n)
+
+# The heavy_hitters_by() function wraps the summary as a reducer:
+
+def heavy_hitters_by(key, capacity=1000):
+    return Reducer(
+        lambda: HeavyHitters(capacity), 
+        lambda summary, detail: summary.update(key(detail)), 
+        HeavyHitters.merge, 
+        HeavyHitters.most_common
+        )
+
+# And reduce_book_heavy_hitters() is a bounded-memory alternative 
+# to reduce_book_total():
+
+def reduce_book_heavy_hitters(iterable, capacity=1000):
+    summary = HeavyHitters(capacity)
+    for detail in iterable:
+        summary.update(detail.url.path)
+    return summary
+
+#---------------
+# Counting distinct visitors with HyperLogLog
+#---------------
+
+# Counting the distinct hosts for each book page exactly needs a set 
+# of hosts per path. A HyperLogLog sketch estimates the same number 
+# with a fixed 2**precision bytes per path. 
+# The relative standard error is about 1.04/sqrt(2**precision): 
+# 1.6% with the default precision of 12, which uses 4 KB per sketch.
+
+# Each value is hashed to 64 bits. The first precision bits pick 
+# a register, and the register keeps the largest position of the first 
+# 1 bit seen in the remaining bits. The hash comes from hashlib, 
+# since the built-in hash() of a str differs from process to process. 
+# Two sketches merge by taking the maximum of each register, 
+# and a sketch serializes as a fixed-size blob of bytes for IPC:
+
+class HyperLogLog:
+    __slots__ = ('precision', 'registers')
+
+    def __init__(self, precision=12, registers=None):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision must be from 4 to 16")
+        self.precision = precision
+        self.registers = bytearray(registers or 2**precision)
+
+    def update(self, value):
+        h = int.from_bytes(
+            hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 
+            'big'
+            )
+        bits = 64 - self.precision
+        index = h >> bits
+        rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+        return self
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("can't merge sketches with different precisions")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213/(1 + 1.079/m)
+        raw = alpha*m*m/sum(2.0**-r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5*m and zeros:
+            return m*math.log(m/zeros)
+        return raw
+
+    def to_bytes(self):
+        return bytes([self.precision]) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, blob):
+        return cls(blob[0], blob[1:])
+
+    def __reduce__(self):
+        return (HyperLogLog.from_bytes, (self.to_bytes(),))
+
+# The distinct_sketch_by() reducer keeps one sketch for each key:
+
+def merge_sketches(left, right):
+    for name, sketch in right.items():
+        left[name].merge(sketch)
+    return left
+
+def distinct_sketch_by(key, value, precision=12):
+    def update(sketches, detail):
+        sketches[key(detail)].update(value(detail))
+        return sketches
+    return Reducer(
+        lambda: defaultdict(partial(HyperLogLog, precision)), 
+        update, merge_sketches, 
+        lambda sketches: {
+            name: round(sketch.estimate()) 
+            for name, sketch in sketches.items()
+            }
+        )
+
+# Registering it adds the distinct visitors of each book page 
+# to run_multi_analysis() and to the pool merge in ch12_ex02:
+
+dashboardReducers['book_visitors'] = when(
+    isthere_book_in_path, distinct_sketch_by(get_path, get_host)
+    )
+
+#---------------
+# Prefiltering the lines before parsing
+#---------------
+
+# Every line pays for the regular expression, parse_time(), urlparse() 
+# and parse_agent() before filter_books() can reject it. 
+# A path predicate can declare, as its required attribute, a substring 
+# that any path it accepts must contain, like isthere_book_in_path() does.
+# A raw line that doesn't contain the required text can't produce 
+# an accepted path, so it can be rejected with a plain substring check. 
+# The check is built from the predicates themselves; predicates 
+# without a required substring don't reject anything. 
+# With as_bytes=True, the prefilter works on undecoded lines:
+
+def make_prefilter(*predicates, as_bytes=False):
+    required = tuple(
+        predicate.required.encode('us-ascii') if as_bytes 
+        else predicate.required
+        for predicate in predicates 
+        if hasattr(predicate, 'required')
+        )
+    def prefilter(line):
+        return all(text in line for text in required)
+    return prefilter
+
+def prefilter_lines(prefilter, iterable):
+    return (
+        filter(prefilter, logfile) 
+        for logfile in iterable
+        )
+
 #---------------
 # The complete analysis process
 #---------------
@@ -328,5 +1087,89 @@ def run_analysis(filename):
     totals = reduce_book_total(books)
     return totals
 
+# The same analysis, with the rejected records reported 
+# alongside the totals:
+
+AnalysisResult = namedtuple('AnalysisResult', ['totals', 'rejections'])
+
+def run_analysis_with_rejections(filename, sample_size=100):
+    rejections = Rejections(sample_size)
+    details = remove_fields(\
+        convert_to_accessdetail_tuples(\
+        convert_to_access_tuples(\
+        read_gzip_files(filename)
+        ), rejections))
+    books = filter_books(details)
+    totals = reduce_book_total(books)
+    return AnalysisResult(totals, rejections)
+
+# The same analysis, using the bytes-native parsing stages:
+
+def run_analysis_bytes(filename):
+    details = remove_fields(\
+        convert_to_accessdetail_tuples(\
+        convert_to_access_tuples_bytes(\
+        read_gzip_files_bytes(filename)
+        )))
+    books = filter_books(details)
+    totals = reduce_book_total(books)
+    return totals
+
+# The same analysis, with lines rejected by the prefilter before parsing. 
+# The results are identical to run_analysis():
+
+def run_prefiltered_analysis(filename):
+    prefilter = make_prefilter(isthere_book_in_path)
+    details = remove_fields(\
+        convert_to_accessdetail_tuples(\
+        convert_to_access_tuples(\
+        prefilter_lines(prefilter, read_gzip_files(filename))
+        )))
+    books = filter_books(details)
+    totals = reduce_book_total(books)
+    return totals
+
+# The same analysis, with the book totals kept in a bounded summary:
+
+def run_bounded_analysis(filename, capacity=1000):
+    details = remove_fields(\
+        convert_to_accessdetail_tuples(\
+        convert_to_access_tuples(\
+        read_gzip_files(filename)
+        )))
+    books = filter_books(details)
+    return reduce_book_heavy_hitters(books, capacity)
+
+# One parse of the logs feeds every report in a registry of reducers. 
+# The accumulate_analysis() function returns the accumulators before 
+# their result() functions are applied, so they can still be merged:
+
+def accumulate_analysis(filename, reducers=dashboardReducers):
+    details = remove_fields(\
+        convert_to_accessdetail_tuples(\
+        convert_to_access_tuples(\
+        read_gzip_files(filename)
+        )))
+    return reduce_all(reducers, details)
+
+def run_multi_analysis(filename, reducers=dashboardReducers):
+    return finish_all(reducers, accumulate_analysis(filename, reducers))
+
+# The same analysis, with decompression overlapped with parsing.
+# The timings of the stages are returned alongside the totals:
+
+PipelinedResult = namedtuple('PipelinedResult', ['totals', 'timings'])
+
+def run_pipelined_analysis(filename):
+    timings = Counter()
+    details = remove_fields(\
+        convert_to_accessdetail_tuples(\
+        convert_to_access_tuples(\
+        read_gzip_files_pipelined(filename, timings)
+        )))
+    books = filter_books(details)
+    totals = reduce_book_total(books)
+    return PipelinedResult(totals, timings)
+
 
 results = dict(run_analysis('example.log.gz'))
@@ -5,9 +5,13 @@
 import os, sys
 from re import I
 import glob
-from concurrent.futures import ProcessPoolExecutor
-from multiprocessing import Pool
-from collections import Counter
+import time
+import zlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import Pool, Process, SimpleQueue
+from collections import namedtuple, Counter, deque
+from functools import partial, reduce
 
 '''
 import re
@@ -22,7 +26,11 @@ rootRelativePath = '..'
 rootAbsolutePath = os.path.abspath(rootRelativePath)
 sys.path.append(rootAbsolutePath)
 
-from CH12.ch12_ex01 import run_analysis
+from CH12.ch12_ex01 import run_analysis, convert_to_access_tuples, \
+    convert_to_accessdetail_tuples, remove_fields, filter_books, \
+    reduce_book_total, dashboardReducers, accumulate_analysis, \
+    reduce_all, merge_all, finish_all, run_bounded_analysis, HeavyHitters, \
+    read_gzip_blocks, split_block
 
 ###########################################
 # Using a multiprocessing pool for concurrent processing
@@ -104,3 +112,278 @@ def run_multithreaded_analysis():
         for result in results:
             combined.update(result)
 
+###########################################
+# Processing a single large file in parallel chunks
+###########################################
+
+# Mapping whole files to workers doesn't help when there are only 
+# a few very large files: one worker decompresses and parses 
+# a multi-GB log while the rest of the pool sits idle.
+# Instead, we can split the decompressed stream into line-aligned 
+# blocks of bytes, and send each block through the pipeline 
+# in a separate worker.
+
+# The read_gzip_blocks() function from the pipelined reader already 
+# yields line-aligned blocks, so no line is ever split between two chunks.
+
+# Each worker splits its chunk into lines with split_block(), which 
+# splits on '\n' only, like read_gzip_files() does, and applies the 
+# same stages that run_analysis() uses, returning a partial Counter:
+
+def analyze_chunk(chunk):
+    lines = split_block(chunk)
+    details = remove_fields(\
+        convert_to_accessdetail_tuples(\
+        convert_to_access_tuples([lines])
+        ))
+    books = filter_books(details)
+    return reduce_book_total(books)
+
+# The run_chunked_analysis() function is the chunk-parallel mode 
+# of run_analysis(). The Pool.imap() family would read ahead the whole 
+# file to feed the workers, so we use apply_async() and keep at most 
+# two chunks per worker in flight. This keeps memory use bounded 
+# no matter how large the log is:
+
+def run_chunked_analysis(pattern, pool_size=4, chunk_size=2**22):
+    chunks = (
+        chunk
+        for zip_file in glob.glob(pattern)
+        for chunk in read_gzip_blocks(zip_file, chunk_size)
+        )
+    combined = Counter()
+    pending = deque()
+    with Pool(pool_size) as workers:
+        for chunk in chunks:
+            if len(pending) >= 2*pool_size:
+                combined.update(pending.popleft().get())
+            pending.append(workers.apply_async(analyze_chunk, (chunk,)))
+        for result in pending:
+            combined.update(result.get())
+    return combined
+
+#---------------
+# Merging bounded summaries
+#---------------
+
+# A variation of run_parallel_analysis_2() where each worker returns 
+# a HeavyHitters summary of at most 2*capacity entries, instead of 
+# a Counter that grows with the number of distinct paths:
+
+def run_parallel_bounded_analysis(pattern, capacity=1000):
+    combined = HeavyHitters(capacity)
+    with Pool() as workers:
+        results = workers.imap_unordered(
+            partial(run_bounded_analysis, capacity=capacity), 
+            glob.glob(pattern)
+            )
+        for result in results:
+            combined.merge(result)
+    return combined
+
+#---------------
+# Compact results merged in shards
+#---------------
+
+# Pickling a Counter sends every key and every count as separate objects. 
+# A worker can encode its Counter as two byte strings instead: 
+# a table of the keys, separated by newlines (a log path can't contain 
+# one), and an array of 64-bit counts in the same order:
+
+def encode_counter(counts):
+    return (
+        '\n'.join(counts.keys()).encode('utf-8'), 
+        array('q', counts.values()).tobytes()
+        )
+
+def decode_counter(encoded):
+    keys, values = encoded
+    if not keys:
+        return Counter()
+    return Counter(dict(zip(
+        keys.decode('utf-8').split('\n'), 
+        array('q', values)
+        )))
+
+# Merging every result in the parent makes it a serial bottleneck. 
+# Merging the results in pairs in the pool instead was more than twice 
+# as slow: every round sends the merged results out and back again.
+# Instead, each worker splits its Counter into shards by a stable hash 
+# of the key, and sends each shard straight to the merge process that 
+# owns it. The shards never share a key, so the merge processes work 
+# side by side and never exchange anything. The parent only collects 
+# one merged shard from each of them.
+
+def shard_of(key, shards):
+    return zlib.crc32(key.encode('utf-8')) % shards
+
+def split_counter(counts, shards):
+    parts = [Counter() for _ in range(shards)]
+    for key, count in counts.items():
+        parts[shard_of(key, shards)][key] = count
+    return parts
+
+# The queues are given to each worker when it starts. Every worker sends
+# one shard per file to every merge process, even when it's empty, 
+# so a merge process knows when it has received everything:
+
+shardQueues = []
+
+def set_shard_queues(queues):
+    shardQueues[:] = queues
+
+def analyze_to_shards(filename):
+    parts = split_counter(run_analysis(filename), len(shardQueues))
+    for queue, part in zip(shardQueues, parts):
+        queue.put(encode_counter(part))
+
+def merge_shard(queue, files, results):
+    combined = Counter()
+    for _ in range(files):
+        combined.update(decode_counter(queue.get()))
+    results.put(encode_counter(combined))
+
+def start_mergers(files, shards):
+    queues = [SimpleQueue() for _ in range(shards)]
+    results = SimpleQueue()
+    mergers = [
+        Process(target=merge_shard, args=(queue, files, results))
+        for queue in queues
+        ]
+    for merger in mergers:
+        merger.start()
+    return queues, results, mergers
+
+# If a file fails, the merge processes would wait for its shards forever,
+# so they're stopped before the error is raised:
+
+def stop_mergers(mergers):
+    for merger in mergers:
+        merger.terminate()
+        merger.join()
+
+def collect_shards(results, mergers):
+    combined = Counter()
+    for _ in mergers:
+        combined.update(decode_counter(results.get()))
+    for merger in mergers:
+        merger.join()
+    return combined
+
+def run_parallel_analysis_sharded(pattern, pool_size=4, shards=2):
+    files = glob.glob(pattern)
+    queues, results, mergers = start_mergers(len(files), shards)
+    try:
+        with Pool(pool_size, set_shard_queues, (queues,)) as workers:
+            for _ in workers.imap_unordered(analyze_to_shards, files):
+                pass
+    except BaseException:
+        stop_mergers(mergers)
+        raise
+    return collect_shards(results, mergers)
+
+def run_multithreaded_analysis_sharded(pattern, pool_size=4, shards=2):
+    files = glob.glob(pattern)
+    queues, results, mergers = start_mergers(len(files), shards)
+    try:
+        with ProcessPoolExecutor(
+                max_workers=pool_size, 
+                initializer=set_shard_queues, initargs=(queues,)
+                ) as workers:
+            for future in as_completed(
+                    [workers.submit(analyze_to_shards, f) for f in files]
+                    ):
+                future.result()
+    except BaseException:
+        stop_mergers(mergers)
+        raise
+    return collect_shards(results, mergers)
+
+#---------------
+# Scheduling the files by size
+#---------------
+
+# Handing out files in glob order means a very large file that comes 
+# last keeps one worker busy long after the others are idle. 
+# The plan_tasks() function uses longest-processing-time-first scheduling: 
+# the files are sorted by their size, largest first. 
+# A file larger than a worker's fair share is split. A GZIP file can't 
+# be entered in the middle, so the parent decompresses it once, and 
+# fans its line-aligned chunks out to the pool, as run_chunked_analysis() 
+# does. The other files are analyzed whole by a single worker.
+
+Task = namedtuple('Task', ['zip_file', 'size', 'split'])
+
+def plan_tasks(zip_files, pool_size):
+    sizes = {zip_file: os.path.getsize(zip_file) for zip_file in zip_files}
+    target = max(sum(sizes.values())/(2*pool_size), 1)
+    tasks = (
+        Task(zip_file, size, size > target)
+        for zip_file, size in sizes.items()
+        )
+    return sorted(tasks, key=lambda task: task.size, reverse=True)
+
+# Each task becomes a stream of work items: a function and its argument.
+
+def task_work(tasks, chunk_size):
+    for task in tasks:
+        if task.split:
+            for chunk in read_gzip_blocks(task.zip_file, chunk_size):
+                yield analyze_chunk, chunk
+        else:
+            yield run_analysis, task.zip_file
+
+# The worker reports its process id and the time it was busy, 
+# along with the partial Counter:
+
+def timed(function, argument):
+    start = time.perf_counter()
+    counts = function(argument)
+    return counts, os.getpid(), time.perf_counter() - start
+
+# As in run_chunked_analysis(), apply_async() keeps at most two work 
+# items per worker in flight, and each worker takes the next one 
+# as soon as it's free, so the work is balanced dynamically. 
+# The utilization of each worker is its busy time over the wall-clock time. 
+# Workers that never got a task don't appear; they were idle.
+
+def run_scheduled_analysis(pattern, pool_size=4, chunk_size=2**22):
+    work = task_work(plan_tasks(glob.glob(pattern), pool_size), chunk_size)
+    combined = Counter()
+    busy = Counter()
+    pending = deque()
+    def collect(result):
+        counts, pid, seconds = result.get()
+        combined.update(counts)
+        busy[pid] += seconds
+    start = time.perf_counter()
+    with Pool(pool_size) as workers:
+        for function, argument in work:
+            if len(pending) >= 2*pool_size:
+                collect(pending.popleft())
+            pending.append(workers.apply_async(timed, (function, argument)))
+        for result in pending:
+            collect(result)
+    wall = time.perf_counter() - start
+    utilization = {pid: seconds/wall for pid, seconds in busy.items()}
+    return combined, utilization
+
+def pool_utilization(utilization, pool_size=4):
+    return sum(utilization.values())/pool_size
+
+###########################################
+# Merging several reports from a pool
+###########################################
+
+# The reducers in the registry are built from closures and lambdas, 
+# which can't be pickled. Each worker uses the registry defined in 
+# ch12_ex01, and returns only its accumulators: Counters, dicts and sets.
+# The parent merges them with each reducer's merge() function, 
+# starting from a set of empty accumulators:
+
+def run_parallel_multi_analysis(pattern, pool_size=4):
+    empty = reduce_all(dashboardReducers, ())
+    with Pool(pool_size) as workers:
+        results = workers.imap_unordered(accumulate_analysis, glob.glob(pattern))
+        combined = reduce(partial(merge_all, dashboardReducers), results, empty)
+    return finish_all(dashboardReducers, combined)
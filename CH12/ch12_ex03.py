@@ -0,0 +1,188 @@
+###########################################
+# Imports
+###########################################
+
+import os, sys
+from array import array
+from collections import namedtuple, Counter
+from functools import partial
+from itertools import compress, islice
+
+rootRelativePath = '..'
+rootAbsolutePath = os.path.abspath(rootRelativePath)
+sys.path.append(rootAbsolutePath)
+
+from CH12.ch12_ex01 import Access, formatPattern, read_gzip_files, \
+    parse_request, parse_time, parse_agent, parse_url, \
+    is_nonempty_path, arethere_excluded_names, arethere_excluded_extensions, \
+    bookItem
+
+###########################################
+# Processing the access log in columnar batches
+###########################################
+
+'''
+Each log line becomes an Access namedtuple, and then an AccessDetails
+namedtuple that wraps it. Every stage of the pipeline handles one
+record at a time.
+
+In batch mode, the lines are grouped into batches of about 64K rows.
+A batch holds one column per field: a tuple of strings, or a compact
+array for the numeric fields. Each stage works on a whole batch,
+and memory use depends on the batch size, not on the size of the log.
+'''
+
+#---------------
+# Building batches of Access columns
+#---------------
+
+# An AccessBatch has the same fields as an Access namedtuple,
+# but each field is a column of values:
+
+AccessBatch = namedtuple('AccessBatch', Access._fields)
+
+def parse_bytes(text):
+    return int(text) if text.isdigit() else 0
+
+# The regular expression groups are in the same order as the Access fields.
+# A batch of rows is transposed into columns with zip(*rows).
+# The status stays a column of strings, as it is in an Access namedtuple.
+# The sizes are packed into an array, unless one of them is too large 
+# for a 64-bit integer:
+
+def int_column(values):
+    values = tuple(values)
+    try:
+        return array('q', values)
+    except OverflowError:
+        return values
+
+def make_access_batch(rows):
+    host, identity, user, time, request, status, size, user_agent = zip(*rows)
+    return AccessBatch(
+        host, identity, user, time, request, status,
+        int_column(map(parse_bytes, size)),
+        user_agent
+        )
+
+def convert_to_access_batches(iterable, batch_size=65536):
+    matches = (
+        formatPattern.match(line)
+        for logfile in iterable
+        for line in logfile
+        )
+    rows = (match.groups() for match in matches if match)
+    while True:
+        batch = tuple(islice(rows, batch_size))
+        if not batch:
+            break
+        yield make_access_batch(batch)
+
+# Filtering a batch means selecting the same rows from every column:
+
+def select_column(column, selectors):
+    if isinstance(column, array):
+        return array(column.typecode, compress(column, selectors))
+    if hasattr(column, '_fields'):
+        return select_rows(column, selectors)
+    return tuple(compress(column, selectors))
+
+def select_rows(batch, selectors):
+    selectors = tuple(selectors)
+    return type(batch)._make(
+        select_column(column, selectors)
+        for column in batch
+        )
+
+#---------------
+# Parsing additional columns of an AccessBatch
+#---------------
+
+# The downstream stages only use the path of the URL,
+# so the detail batch keeps a path column instead of ParseResult objects:
+
+AccessDetailBatch = namedtuple(
+    'AccessDetailBatch',
+    ['access', 'time', 'method', 'path', 'protocol', 'agent']
+    )
+
+# Rejected rows are recorded in an optional Rejections object:
+
+def parse_detail_row(request, ts, user_agent, rejections=None):
+    try:
+        meth, uri, protocol = parse_request(request)
+        return (
+            parse_time(ts), meth, parse_url(uri).path, protocol,
+            parse_agent(user_agent)
+            )
+    except ValueError as e:
+        if rejections is not None:
+            rejections.add(e, (request, ts, user_agent))
+
+def convert_to_accessdetail_batch(batch, rejections=None):
+    rows = tuple(map(
+        partial(parse_detail_row, rejections=rejections),
+        batch.request, batch.time, batch.user_agent
+        ))
+    access = select_rows(batch, (row is not None for row in rows))
+    columns = tuple(zip(*filter(None, rows))) or ((),)*5
+    return AccessDetailBatch(access, *columns)
+
+def convert_to_accessdetail_batches(iterable, rejections=None):
+    return map(
+        partial(convert_to_accessdetail_batch, rejections=rejections),
+        iterable
+        )
+
+#---------------
+# Filtering and analyzing whole batches
+#---------------
+
+# The batch versions of remove_fields() and filter_books() compute
+# one selector per row, and skip batches that end up empty:
+
+def is_kept_path(path):
+    names = path.split('/')
+    return (
+        is_nonempty_path(names)
+        and not arethere_excluded_names(names)
+        and not arethere_excluded_extensions(names[-1])
+        )
+
+def is_book_path(path):
+    names = tuple(name for name in path.split('/') if name)
+    return names[0] == bookItem and len(names) > 1
+
+def filter_batches(path_rule, iterable):
+    for batch in iterable:
+        selected = select_rows(batch, map(path_rule, batch.path))
+        if selected.path:
+            yield selected
+
+def remove_fields_batches(iterable):
+    return filter_batches(is_kept_path, iterable)
+
+def filter_books_batches(iterable):
+    return filter_batches(is_book_path, iterable)
+
+# Counting a whole column at once is done by Counter.update():
+
+def reduce_book_total_batches(iterable):
+    counts = Counter()
+    for batch in iterable:
+        counts.update(batch.path)
+    return counts
+
+#---------------
+# The complete batch analysis process
+#---------------
+
+def run_batch_analysis(filename, batch_size=65536):
+    details = remove_fields_batches(\
+        convert_to_accessdetail_batches(\
+        convert_to_access_batches(\
+        read_gzip_files(filename), batch_size
+        )))
+    books = filter_books_batches(details)
+    totals = reduce_book_total_batches(books)
+    return totals
@@ -0,0 +1,211 @@
+###########################################
+# Imports
+###########################################
+
+import os, sys
+import glob
+import hashlib
+import json
+import zlib
+from collections import namedtuple, Counter
+
+rootRelativePath = '..'
+rootAbsolutePath = os.path.abspath(rootRelativePath)
+sys.path.append(rootAbsolutePath)
+
+from CH12.ch12_ex01 import convert_to_access_tuples, \
+    convert_to_accessdetail_tuples, remove_fields, filter_books, \
+    reduce_book_total
+
+###########################################
+# Incremental analysis with checkpoints
+###########################################
+
+'''
+The run_analysis() function rereads and reparses every file that
+matches the pattern, every time. Access logs are append-only and
+rotated daily, so almost all of that work was already done by a
+previous run.
+
+A GZIP file can hold several members one after another. Appending to
+a compressed log adds new members and never changes the old ones.
+For each file we save its identity (inode and size), the offset where
+its last complete member ends, and the counts found so far.
+A rerun skips unchanged files, and for files that grew it decompresses
+only the members after the saved offset.
+'''
+
+#---------------
+# Reading only the new gzip members
+#---------------
+
+# The same stages as run_analysis(), applied to an iterable of lines:
+
+def analyze_lines(lines):
+    details = remove_fields(\
+        convert_to_accessdetail_tuples(\
+        convert_to_access_tuples([lines])
+        ))
+    books = filter_books(details)
+    return reduce_book_total(books)
+
+def decode_lines(lines):
+    return (line.decode('us-ascii').rstrip() for line in lines)
+
+# The read_new_members() function starts decompressing at a member boundary,
+# and yields an offset and the counts of the lines found since the previous
+# offset. A line can be split between two members, so the unfinished line
+# at the end of a member is carried over into the next one, and an offset
+# is yielded only at a member end where no line is unfinished. 
+# The members after the last offset, either incomplete or ending in 
+# the middle of a line that's still being written, are ignored;
+# they will be read again by the next run once they are complete.
+# The analyze function turns a batch of lines into a Counter:
+
+def read_new_members(zip_file, offset, block_size=2**20, analyze=analyze_lines):
+    with open(zip_file, "rb") as fh:
+        fh.seek(offset)
+        data = fh.read(block_size)
+        counts = Counter()
+        remainder = b''
+        while data:
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            consumed = 0
+            while True:
+                lines = (remainder + decompressor.decompress(data)).split(b'\n')
+                remainder = lines.pop()
+                counts.update(analyze(decode_lines(lines)))
+                if decompressor.eof:
+                    break
+                consumed += len(data)
+                data = fh.read(block_size)
+                if not data:
+                    return
+            unused = decompressor.unused_data
+            offset += consumed + len(data) - len(unused)
+            data = unused or fh.read(block_size)
+            if not remainder:
+                yield offset, counts
+                counts = Counter()
+
+#---------------
+# Saving and restoring the checkpoints
+#---------------
+
+# The checkpoint of each file is a namedtuple. The totals are kept
+# per file, so a file that was replaced can be counted again from scratch.
+# A file is identified by its device and inode, so a state file saved
+# without the device gets None for it. 
+# An inode is reused once its file is deleted, so the state also keeps 
+# a fingerprint of the first bytes of the file. A state file saved 
+# without it gets None, and its files are counted again once:
+
+FileState = namedtuple(
+    'FileState', 
+    ['inode', 'size', 'offset', 'totals', 'device', 'fingerprint'], 
+    defaults=(None, None)
+    )
+
+# The fingerprint is a hash of the first 4 KB of the file, or of all of it 
+# if it was smaller when the state was saved. Appending never changes them,
+# and the GZIP header of a new file holds its own timestamp:
+
+fingerprintSize = 4096
+
+def fingerprint(zip_file, size):
+    with open(zip_file, "rb") as fh:
+        prefix = fh.read(min(size, fingerprintSize))
+    return hashlib.blake2b(prefix, digest_size=16).hexdigest()
+
+def load_state(state_file):
+    try:
+        with open(state_file) as fh:
+            saved = json.load(fh)
+    except FileNotFoundError:
+        return {}
+    return {
+        name: FileState(**file_state)
+        for name, file_state in saved.items()
+        }
+
+# The state is written to a temporary file and then renamed,
+# so an interrupted run never leaves a damaged state file behind:
+
+def save_state(state_file, state):
+    temporary = state_file + '.tmp'
+    with open(temporary, 'w') as fh:
+        json.dump(
+            {name: file_state._asdict() for name, file_state in state.items()},
+            fh
+            )
+    os.replace(temporary, state_file)
+
+# A file is read from the saved offset only when it's the same file
+# (same device, inode and fingerprint) and it hasn't shrunk. 
+# Otherwise it's read from the start:
+
+def is_same_file(file_state, zip_file, stat):
+    return (
+        file_state.inode == stat.st_ino
+        and file_state.device in (None, stat.st_dev)
+        and file_state.size <= stat.st_size
+        and file_state.fingerprint == fingerprint(zip_file, file_state.size)
+        )
+
+def update_file_state(zip_file, file_state):
+    stat = os.stat(zip_file)
+    if not (file_state and is_same_file(file_state, zip_file, stat)):
+        file_state = FileState(
+            stat.st_ino, 0, 0, {}, stat.st_dev, fingerprint(zip_file, 0)
+            )
+    if file_state.size == stat.st_size:
+        return file_state._replace(device=stat.st_dev)
+    offset, totals = file_state.offset, Counter(file_state.totals)
+    for offset, counts in read_new_members(zip_file, offset):
+        totals.update(counts)
+    return FileState(
+        stat.st_ino, stat.st_size, offset, dict(totals), stat.st_dev, 
+        fingerprint(zip_file, stat.st_size)
+        )
+
+#---------------
+# The complete incremental analysis process
+#---------------
+
+# The run_incremental_analysis() function saves the state after each file.
+# Files that no longer match the pattern keep their counts in the totals.
+# Rotation renames files, for example access.log.1.gz to access.log.2.gz, 
+# so the saved state of a file is found by its device and inode, 
+# not by its name. The entry under its old name is dropped, 
+# unless another file has already taken that name in this run.
+# A new file that reuses the inode of a deleted one doesn't match 
+# its fingerprint, so it doesn't take over the deleted file's entry:
+
+def names_by_identity(state):
+    return {
+        (file_state.device, file_state.inode): name
+        for name, file_state in state.items()
+        }
+
+def combine_totals(state):
+    combined = Counter()
+    for file_state in state.values():
+        combined.update(file_state.totals)
+    return combined
+
+def run_incremental_analysis(pattern, state_file='analysis_state.json'):
+    state = load_state(state_file)
+    previous = dict(state)
+    identities = names_by_identity(previous)
+    for zip_file in glob.glob(pattern):
+        name = os.path.abspath(zip_file)
+        stat = os.stat(zip_file)
+        old_name = identities.get((stat.st_dev, stat.st_ino), name)
+        if old_name != name and not is_same_file(
+                previous[old_name], zip_file, stat):
+            old_name = name
+        if old_name != name and state.get(old_name) is previous[old_name]:
+            del state[old_name]
+        state[name] = update_file_state(zip_file, previous.get(old_name))
+        save_state(state_file, state)
+    return combine_totals(state)
@@ -0,0 +1,166 @@
+###########################################
+# Imports
+###########################################
+
+import os, sys
+import glob
+import gzip
+import json
+from collections import namedtuple, Counter
+
+rootRelativePath = '..'
+rootAbsolutePath = os.path.abspath(rootRelativePath)
+sys.path.append(rootAbsolutePath)
+
+from CH12.ch12_ex01 import convert_to_access_tuple, convert_to_access_tuples, \
+    convert_to_accessdetail_tuples, remove_fields, filter_books, \
+    reduce_book_total, parse_time, read_gzip_blocks, split_block
+
+###########################################
+# A sidecar seek index for time-window queries
+###########################################
+
+'''
+A GZIP stream can only be decompressed from the beginning, so asking
+for the book hits of a single hour means decompressing and parsing
+the whole log. The zlib state at an arbitrary point can't be saved
+to disk from Python, so instead of zlib restart points we use
+re-compressed block boundaries.
+
+On the first scan, the log is copied into a sidecar file of independent
+GZIP members of about 1 MB of text each. A GZIP file made of several
+members is still a valid GZIP file. An index file records, for each
+block, its offset and length in the sidecar, the number of its first
+line, and the earliest and latest timestamps in the block.
+
+Lines aren't written in strict time order, so the index keeps the
+range of each block, not just its first timestamp. A time-windowed
+query decompresses only the blocks whose range overlaps the window.
+'''
+
+#---------------
+# Building the index
+#---------------
+
+# Each entry of the index is a namedtuple. Timestamps are stored
+# as POSIX seconds so the index can be saved as JSON.
+# The sidecar names don't end in '.gz', so a '*.gz' pattern
+# won't pick them up as logs:
+
+Block = namedtuple(
+    'Block', ['offset', 'length', 'first_line', 'min_time', 'max_time']
+    )
+
+def index_paths(zip_file):
+    return zip_file + '.blk', zip_file + '.idx'
+
+# A block is split into lines with split_block(), on '\n' only, 
+# like read_gzip_files() does, so the line numbers in the index 
+# and the lines of a window agree with run_analysis():
+
+def line_timestamps(lines):
+    for line in lines:
+        access = convert_to_access_tuple(line)
+        if access:
+            try:
+                yield parse_time(access.time).timestamp()
+            except ValueError:
+                pass
+
+# The build_index() function writes the sidecar and the index.
+# The size and modification time of the log are saved with the index,
+# so a stale index can be detected:
+
+def build_index(zip_file, block_size=2**20):
+    blocks_file, index_file = index_paths(zip_file)
+    blocks = []
+    first_line = 0
+    with open(blocks_file, "wb") as sidecar:
+        for block in read_gzip_blocks(zip_file, block_size):
+            lines = split_block(block)
+            times = tuple(line_timestamps(lines))
+            member = gzip.compress(block)
+            blocks.append(Block(
+                sidecar.tell(), len(member), first_line,
+                min(times, default=None), max(times, default=None)
+                ))
+            sidecar.write(member)
+            first_line += len(lines)
+    stat = os.stat(zip_file)
+    with open(index_file, "w") as fh:
+        json.dump(
+            {'size': stat.st_size, 'mtime': stat.st_mtime, 'blocks': blocks},
+            fh
+            )
+    return blocks
+
+def load_index(zip_file):
+    index_file = index_paths(zip_file)[1]
+    stat = os.stat(zip_file)
+    try:
+        with open(index_file) as fh:
+            saved = json.load(fh)
+    except FileNotFoundError:
+        return build_index(zip_file)
+    if (saved['size'], saved['mtime']) != (stat.st_size, stat.st_mtime):
+        return build_index(zip_file)
+    return [Block(*block) for block in saved['blocks']]
+
+#---------------
+# Querying a time window
+#---------------
+
+# A block overlaps the window start <= time < end when its range does.
+# Blocks without any parsable timestamp are never selected:
+
+def overlaps(block, start, end):
+    return (
+        block.min_time is not None
+        and block.min_time < end.timestamp()
+        and block.max_time >= start.timestamp()
+        )
+
+def read_window_lines(zip_file, start, end):
+    blocks_file = index_paths(zip_file)[0]
+    selected = [block for block in load_index(zip_file) if overlaps(block, start, end)]
+    with open(blocks_file, "rb") as sidecar:
+        for block in selected:
+            sidecar.seek(block.offset)
+            text = gzip.decompress(sidecar.read(block.length))
+            yield split_block(text)
+
+# The selected blocks can still hold lines from outside the window,
+# so the details are filtered by time as well:
+
+def filter_window(start, end, iterable):
+    return (
+        detail
+        for detail in iterable
+        if start <= detail.time < end
+        )
+
+def run_windowed_analysis(pattern, start, end):
+    """Book hits with start <= time < end. start and end must be
+    timezone-aware datetimes.
+    """
+    totals = Counter()
+    for zip_file in glob.glob(pattern):
+        details = filter_window(start, end,\
+            remove_fields(\
+            convert_to_accessdetail_tuples(\
+            convert_to_access_tuples(\
+            read_window_lines(zip_file, start, end)
+            ))))
+        books = filter_books(details)
+        totals.update(reduce_book_total(books))
+    return totals
+
+# "Book hits between 22:00 and 23:00 on June 1" looks like this:
+
+'''
+>>> from datetime import datetime, timedelta, timezone
+>>> edt = timezone(timedelta(hours=-4))
+>>> run_windowed_analysis('../example.log.gz',
+...     datetime(2012, 6, 1, 22, 0, tzinfo=edt),
+...     datetime(2012, 6, 1, 23, 0, tzinfo=edt))
+'''
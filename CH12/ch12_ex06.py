@@ -0,0 +1,143 @@
+###########################################
+# Imports
+###########################################
+
+import os, sys
+import asyncio
+import glob
+import gzip
+import stat
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+rootRelativePath = '..'
+rootAbsolutePath = os.path.abspath(rootRelativePath)
+sys.path.append(rootAbsolutePath)
+
+from CH12.ch12_ex04 import analyze_lines, decode_lines
+
+###########################################
+# Reading many log sources concurrently with asyncio
+###########################################
+
+'''
+The read_gzip_files() function reads its files strictly one after
+another. When the logs come from dozens of spool directories and
+named pipes, a pipe with no writer, or a slow disk, holds up
+every source after it.
+
+Here, each source has its own reader task. The readers put batches
+of lines into one bounded asyncio.Queue, and a single task takes
+the batches from the queue and runs them through the parsing
+pipeline. When the parser falls behind, the queue fills up, and
+the readers wait at put() instead of reading more lines into memory.
+A slow source only delays its own reader.
+'''
+
+#---------------
+# Reading each kind of source
+#---------------
+
+# Plain files and GZIP files can't be read without blocking,
+# so each read of a batch runs in the default thread pool.
+# readlines() with a size hint reads about that many bytes of whole lines.
+# zlib releases the GIL while it decompresses,
+# so several GZIP sources really are decompressed at the same time:
+
+async def read_file(path, batches, batch_size):
+    loop = asyncio.get_running_loop()
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, "rb") as fh:
+        while True:
+            lines = await loop.run_in_executor(None, fh.readlines, batch_size)
+            if not lines:
+                break
+            await batches.put(decode_lines(lines))
+
+# Opening a FIFO blocks until a writer opens the other end.
+# A FIFO opened with O_NONBLOCK reads as empty until a writer appears,
+# so the blocking open runs in a thread of its own, from the openers
+# pool. If it used the default pool, FIFOs without a writer would
+# take all its threads, and the reads of the files would wait behind
+# them. After the open, the pipe is read by the event loop itself,
+# without tying up a thread:
+
+async def read_fifo(path, batches, batch_size, openers):
+    loop = asyncio.get_running_loop()
+    pipe = await loop.run_in_executor(openers, open, path, "rb", 0)
+    reader = asyncio.StreamReader(limit=2**20)
+    transport, protocol = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), pipe
+        )
+    try:
+        batch, size = [], 0
+        async for line in reader:
+            batch.append(line)
+            size += len(line)
+            if size >= batch_size:
+                await batches.put(decode_lines(batch))
+                batch, size = [], 0
+        if batch:
+            await batches.put(decode_lines(batch))
+    finally:
+        transport.close()
+
+def is_fifo(path):
+    return stat.S_ISFIFO(os.stat(path).st_mode)
+
+def read_source(path, batches, batch_size, openers):
+    if is_fifo(path):
+        return read_fifo(path, batches, batch_size, openers)
+    return read_file(path, batches, batch_size)
+
+#---------------
+# Parsing the batches
+#---------------
+
+# The parser runs until it gets None, which is put
+# after every reader has finished:
+
+async def parse_batches(batches, totals):
+    while True:
+        lines = await batches.get()
+        if lines is None:
+            return totals
+        totals.update(analyze_lines(lines))
+
+# There's one opener thread for each FIFO, so a FIFO that never gets
+# a writer only holds up its own open:
+
+async def ingest(sources, queue_size=16, batch_size=2**16):
+    batches = asyncio.Queue(queue_size)
+    totals = Counter()
+    fifos = sum(1 for path in sources if is_fifo(path))
+    openers = ThreadPoolExecutor(max_workers=max(fifos, 1))
+    parser = asyncio.create_task(parse_batches(batches, totals))
+    try:
+        await asyncio.gather(*(
+            read_source(path, batches, batch_size, openers)
+            for path in sources
+            ))
+        await batches.put(None)
+        return await parser
+    finally:
+        parser.cancel()
+        openers.shutdown(wait=False)
+
+#---------------
+# The complete asynchronous analysis process
+#---------------
+
+# Each pattern can name plain files, GZIP files or named pipes:
+
+def run_async_analysis(*patterns, queue_size=16):
+    sources = [
+        path
+        for pattern in patterns
+        for path in sorted(glob.glob(pattern))
+        ]
+    return asyncio.run(ingest(sources, queue_size))
+
+'''
+>>> run_async_analysis('/var/spool/web*/*.log.gz', '/var/spool/pipes/*')
+'''
@@ -0,0 +1,214 @@
+###########################################
+# Imports
+###########################################
+
+import os, sys
+import glob
+import sqlite3
+from collections import Counter
+from datetime import datetime, timezone
+
+rootRelativePath = '..'
+rootAbsolutePath = os.path.abspath(rootRelativePath)
+sys.path.append(rootAbsolutePath)
+
+from CH12.ch12_ex01 import convert_to_access_tuples, \
+    convert_to_accessdetail_tuples, remove_fields, get_path, get_bytes
+from CH12.ch12_ex04 import read_new_members, fingerprint
+
+###########################################
+# A store of per-minute rollups
+###########################################
+
+'''
+Questions like "hits per book per minute over the last 7 days" don't
+need the individual log lines. They need the number of hits and bytes
+for each path and status in each minute. Those rollups are much
+smaller than the logs, so they can be computed once per file, saved
+in a local SQLite database, and queried in milliseconds.
+
+The rollup table uses (minute, path, status) as its primary key, so a
+range of minutes is a range scan of the key. A source table records
+how far each file has been loaded, so loading the same file twice
+doesn't count its lines twice. The logs are append-only GZIP files,
+so a file that grew is loaded from the end of its last complete
+member, like the incremental analysis does.
+'''
+
+#---------------
+# Computing the rollups
+#---------------
+
+# A minute is stored as the POSIX time of its first second.
+# The hits and the bytes of each (minute, path, status) are kept in 
+# one Counter, so the rollups of two batches of lines can be added 
+# with update():
+
+def get_minute(detail):
+    return int(detail.time.timestamp())//60*60
+
+def count_rollups(iterable):
+    counts = Counter()
+    for detail in iterable:
+        key = (get_minute(detail), get_path(detail), int(detail.access.status))
+        counts[('hits',) + key] += 1
+        counts[('bytes',) + key] += get_bytes(detail)
+    return counts
+
+def rollup_lines(lines):
+    return count_rollups(remove_fields(\
+        convert_to_accessdetail_tuples(\
+        convert_to_access_tuples([lines])
+        )))
+
+def rollup_rows(counts):
+    return (
+        (minute, path, status, hits, counts['bytes', minute, path, status])
+        for (field, minute, path, status), hits in counts.items()
+        if field == 'hits'
+        )
+
+#---------------
+# Saving the rollups
+#---------------
+
+# A file is identified by its device and inode, so a log that was
+# renamed by rotation isn't loaded again under its new name.
+# An inode is reused once its file is deleted, so the fingerprint 
+# of the file's first bytes is part of the key as well. A new file 
+# that reuses an inode is a new source, and the rollups of the deleted 
+# file are kept:
+
+def open_rollups(db_file):
+    connection = sqlite3.connect(db_file)
+    with connection:
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS rollup ("
+            " minute INTEGER, path TEXT, status INTEGER,"
+            " hits INTEGER, bytes INTEGER,"
+            " PRIMARY KEY (minute, path, status)"
+            ") WITHOUT ROWID"
+            )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS source ("
+            " device INTEGER, inode INTEGER, fingerprint TEXT, name TEXT,"
+            " size INTEGER, offset INTEGER,"
+            " PRIMARY KEY (device, inode, fingerprint)"
+            ")"
+            )
+    return connection
+
+# The fingerprint saved for a source covers the first bytes of the file 
+# as it was when it was loaded, so each source with the same device and 
+# inode is checked against the same number of bytes of the file:
+
+def find_source(connection, zip_file, stat):
+    rows = connection.execute(
+        "SELECT size, offset, fingerprint FROM source"
+        " WHERE device = ? AND inode = ?",
+        (stat.st_dev, stat.st_ino)
+        )
+    for size, offset, saved in rows:
+        if saved == fingerprint(zip_file, size):
+            return size, offset, saved
+    return 0, 0, None
+
+# Rollups for a minute that's already in the table, from another file
+# or from an earlier part of the same file, are added to the saved values. 
+# The new members of a file and its new offset are saved in a single 
+# transaction. A file that shrank was not appended to, and its old 
+# rollups can't be taken back out of the sums, so it's an error:
+
+def load_file(connection, zip_file):
+    stat = os.stat(zip_file)
+    size, offset, saved = find_source(connection, zip_file, stat)
+    if size == stat.st_size:
+        return False
+    if size > stat.st_size:
+        raise ValueError("{0} shrank after it was loaded".format(zip_file))
+    with connection:
+        for offset, counts in read_new_members(zip_file, offset, analyze=rollup_lines):
+            connection.executemany(
+                "INSERT INTO rollup VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (minute, path, status) DO UPDATE"
+                " SET hits = hits + excluded.hits, bytes = bytes + excluded.bytes",
+                rollup_rows(counts)
+                )
+        connection.execute(
+            "DELETE FROM source"
+            " WHERE device = ? AND inode = ? AND fingerprint = ?",
+            (stat.st_dev, stat.st_ino, saved)
+            )
+        connection.execute(
+            "INSERT INTO source VALUES (?, ?, ?, ?, ?, ?)",
+            (stat.st_dev, stat.st_ino, fingerprint(zip_file, stat.st_size),
+                os.path.abspath(zip_file), stat.st_size, offset)
+            )
+    return True
+
+def load_rollups(db_file, pattern):
+    connection = open_rollups(db_file)
+    try:
+        return [
+            zip_file
+            for zip_file in glob.glob(pattern)
+            if load_file(connection, zip_file)
+            ]
+    finally:
+        connection.close()
+
+#---------------
+# Querying the rollups
+#---------------
+
+# The queries take timezone-aware datetimes, start <= time < end,
+# and an optional path prefix. The rollups can only answer to the minute:
+# the window covers every minute that starts in it, and the minute 
+# that contains start. The minutes come back as UTC datetimes:
+
+def minute_range(start, end):
+    return int(start.timestamp())//60*60, int(end.timestamp())
+
+def hits_per_minute(db_file, start, end, path_prefix=''):
+    connection = open_rollups(db_file)
+    try:
+        rows = connection.execute(
+            "SELECT minute, path, sum(hits) FROM rollup"
+            " WHERE minute >= ? AND minute < ?"
+            " AND substr(path, 1, length(?)) = ?"
+            " GROUP BY minute, path ORDER BY minute, path",
+            minute_range(start, end) + (path_prefix, path_prefix)
+            ).fetchall()
+    finally:
+        connection.close()
+    return [
+        (datetime.fromtimestamp(minute, timezone.utc), path, hits)
+        for minute, path, hits in rows
+        ]
+
+def totals_between(db_file, start, end, path_prefix=''):
+    connection = open_rollups(db_file)
+    try:
+        rows = connection.execute(
+            "SELECT path, sum(hits), sum(bytes) FROM rollup"
+            " WHERE minute >= ? AND minute < ?"
+            " AND substr(path, 1, length(?)) = ?"
+            " GROUP BY path",
+            minute_range(start, end) + (path_prefix, path_prefix)
+            ).fetchall()
+    finally:
+        connection.close()
+    return (
+        Counter({path: hits for path, hits, size in rows}),
+        Counter({path: size for path, hits, size in rows})
+        )
+
+# Hits per book page per minute for a week of logs looks like this:
+
+'''
+>>> load_rollups('rollups.db', '/var/log/httpd/access*.gz')
+>>> hits_per_minute('rollups.db',
+...     datetime(2012, 6, 1, tzinfo=timezone.utc),
+...     datetime(2012, 6, 8, tzinfo=timezone.utc),
+...     path_prefix='/book/')
+'''
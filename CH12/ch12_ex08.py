@@ -0,0 +1,224 @@
+###########################################
+# Imports
+###########################################
+
+import os, sys
+import glob
+import hashlib
+import json
+import mmap
+import struct
+from array import array
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from urllib.parse import ParseResult
+
+rootRelativePath = '..'
+rootAbsolutePath = os.path.abspath(rootRelativePath)
+sys.path.append(rootAbsolutePath)
+
+from CH12.ch12_ex01 import Access, AccessDetails, AgentDetails, \
+    read_gzip_files, convert_to_access_tuples, convert_to_accessdetail_tuples, \
+    remove_fields, filter_books, reduce_book_total
+
+###########################################
+# A binary cache of parsed AccessDetails
+###########################################
+
+'''
+Rerunning a variation of filter_books() or reduce_book_total() on the
+same logs pays again for the regular expression, parse_time(),
+urlparse() and parse_agent() on every line. The parsed details can be
+saved once, in a compact binary file next to each log, and reused.
+
+The cache is columnar. Every distinct string is stored once in a string
+table, and each string field becomes an array of 32-bit indexes into it.
+The time is an array of POSIX seconds, plus an array of UTC offsets.
+The file is memory-mapped, and the arrays are used in place, as
+memoryview objects, without reading or copying them.
+
+The cache is keyed by a hash of the content of the log, so a log that
+was rewritten gets a new cache, even when its size doesn't change.
+'''
+
+#---------------
+# The layout of the cache
+#---------------
+
+# Each string column is a path of attribute names into an AccessDetails:
+
+STRING_COLUMNS = (
+    tuple(('access', name) for name in Access._fields)
+    + (('method',), ('protocol',))
+    + tuple(('url', name) for name in ParseResult._fields)
+    + tuple(('agent', name) for name in AgentDetails._fields)
+    )
+
+def column_name(path):
+    return '.'.join(path)
+
+def cache_path(zip_file):
+    return zip_file + '.cache'
+
+# The content hash is computed in blocks, so it costs only I/O:
+
+def content_hash(zip_file, block_size=2**20):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(zip_file, "rb") as fh:
+        for block in iter(lambda: fh.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+#---------------
+# Writing the cache
+#---------------
+
+# A detail without agent details gets the index -1 in the agent columns:
+
+def get_field(detail, path):
+    value = detail
+    for name in path:
+        if value is None:
+            return None
+        value = getattr(value, name)
+    return value
+
+def build_columns(details):
+    strings = {}
+    columns = {column_name(path): array('i') for path in STRING_COLUMNS}
+    times = array('q')
+    offsets = array('i')
+    for detail in details:
+        for path in STRING_COLUMNS:
+            value = get_field(detail, path)
+            index = -1 if value is None else strings.setdefault(value, len(strings))
+            columns[column_name(path)].append(index)
+        times.append(int(detail.time.timestamp()))
+        offsets.append(int(detail.time.utcoffset().total_seconds()))
+    columns['time'] = times
+    columns['utcoffset'] = offsets
+    return list(strings), columns
+
+# The file is the string table, then each column, aligned to 8 bytes.
+# A JSON footer holds the offsets, and the last 8 bytes hold
+# the length of the footer:
+
+def write_aligned(fh, data):
+    fh.write(b'\0' * (-fh.tell() % 8))
+    offset = fh.tell()
+    fh.write(data)
+    return offset
+
+def build_cache(zip_file):
+    details = convert_to_accessdetail_tuples(\
+        convert_to_access_tuples(\
+        read_gzip_files(glob.escape(zip_file))
+        ))
+    strings, columns = build_columns(details)
+    table = '\n'.join(strings).encode('utf-8')
+    footer = {
+        'hash': content_hash(zip_file),
+        'rows': len(columns['time']),
+        'strings': len(strings),
+        'columns': {},
+        }
+    temporary = cache_path(zip_file) + '.tmp'
+    with open(temporary, "wb") as fh:
+        footer['table'] = (write_aligned(fh, table), len(table))
+        for name, column in columns.items():
+            footer['columns'][name] = (
+                write_aligned(fh, column.tobytes()), column.typecode
+                )
+        encoded = json.dumps(footer).encode('utf-8')
+        fh.write(encoded)
+        fh.write(struct.pack('<q', len(encoded)))
+    os.replace(temporary, cache_path(zip_file))
+
+#---------------
+# Reading the cache
+#---------------
+
+# A ParsedColumns namedtuple has the string table, and a dict of
+# memoryview columns over the memory-mapped file:
+
+ParsedColumns = namedtuple('ParsedColumns', ['rows', 'strings', 'columns'])
+
+def map_cache(zip_file):
+    with open(cache_path(zip_file), "rb") as fh:
+        mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    size, = struct.unpack('<q', mapped[-8:])
+    footer = json.loads(mapped[-8-size:-8])
+    return mapped, footer
+
+def open_cache(zip_file):
+    try:
+        mapped, footer = map_cache(zip_file)
+    except (FileNotFoundError, ValueError, struct.error):
+        footer = None
+    if footer is None or footer['hash'] != content_hash(zip_file):
+        build_cache(zip_file)
+        mapped, footer = map_cache(zip_file)
+    view = memoryview(mapped)
+    offset, length = footer['table']
+    strings = str(view[offset:offset+length], 'utf-8').split('\n')
+    if not footer['strings']:
+        strings = []
+    columns = {
+        name: view[offset:offset+footer['rows']*array(typecode).itemsize].cast(typecode)
+        for name, (offset, typecode) in footer['columns'].items()
+        }
+    return ParsedColumns(footer['rows'], strings, columns)
+
+# The iterate_details() function rebuilds the AccessDetails objects,
+# so the existing filter and reduce functions can be used unchanged:
+
+@lru_cache(maxsize=None)
+def get_timezone(seconds):
+    return timezone(timedelta(seconds=seconds))
+
+def iterate_details(parsed):
+    strings = parsed.strings + [None]
+    columns = [parsed.columns[column_name(path)] for path in STRING_COLUMNS]
+    fields = len(Access._fields)
+    urls = fields + 2
+    agents = urls + len(ParseResult._fields)
+    times = parsed.columns['time']
+    offsets = parsed.columns['utcoffset']
+    for row in range(parsed.rows):
+        values = [strings[column[row]] for column in columns]
+        agent = values[agents:]
+        yield AccessDetails(
+            access = Access(*values[:fields]),
+            time = datetime.fromtimestamp(times[row], get_timezone(offsets[row])),
+            method = values[fields],
+            url = ParseResult(*values[urls:agents]),
+            protocol = values[fields+1],
+            agent = None if agent[0] is None else AgentDetails(*agent)
+            )
+
+def read_cached_details(pattern):
+    for zip_file in glob.glob(pattern):
+        yield from iterate_details(open_cache(zip_file))
+
+#---------------
+# Analyzing the cached details
+#---------------
+
+# The same analysis as run_analysis(), starting from the cache:
+
+def run_cached_analysis(pattern):
+    details = remove_fields(read_cached_details(pattern))
+    books = filter_books(details)
+    return reduce_book_total(books)
+
+# An analysis can also work on the columns directly. For example,
+# counting the indexes in the path column and then looking up
+# the strings counts every path without building any objects:
+
+'''
+>>> from collections import Counter
+>>> parsed = open_cache('../example.log.gz')
+>>> counts = Counter(parsed.columns['url.path'])
+>>> {parsed.strings[index]: count for index, count in counts.items()}
+'''
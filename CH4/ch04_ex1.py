@@ -10,9 +10,16 @@ Chapter 4, Example Set 1
 ###########################################
 
 import xml.etree.ElementTree as XML
+from array import array
+from itertools import islice
 from urllib.request import urlopen
 from math import radians, sin, cos, sqrt, asin
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 ###########################################
 # Parsing an XML file
 ###########################################
@@ -36,6 +43,46 @@ def read_rows_kml(fileHandler):
 with open('../Winter 2012-2013.kml') as fh:
     coordinates = tuple(read_rows_kml(fh))
 
+# A streaming version of read_rows_kml()
+
+# XML.parse() builds the whole document tree before the first 
+# coordinates come out. With XML.iterparse(), each Placemark 
+# is handled as soon as its end tag is read. Every child of the 
+# Document and Folder elements is removed from its parent once it 
+# ends, so the memory used doesn't grow with the size of the file.
+
+def read_rows_kml_iterative(fileHandler):
+    """Yields the same rows as read_rows_kml(), one Placemark at a time.
+
+    >>> from io import StringIO
+    >>> doc = StringIO(
+    ...     '<kml xmlns="http://www.opengis.net/kml/2.2"><Document><Folder>'
+    ...     '<Placemark><Point><coordinates>-76.3,37.5,0</coordinates></Point></Placemark>'
+    ...     '<Placemark><Point><coordinates>-76.2,37.8,0</coordinates></Point></Placemark>'
+    ...     '</Folder></Document></kml>')
+    >>> list(read_rows_kml_iterative(doc))
+    [['-76.3', '37.5', '0'], ['-76.2', '37.8', '0']]
+    """
+    ns0 = "{http://www.opengis.net/kml/2.2}"
+    placemarkPath = [ns0 + "kml", ns0 + "Document", ns0 + "Folder", ns0 + "Placemark"]
+    coordinatesPath = "./{0}Point/{0}coordinates".format(ns0)
+    containers = {ns0 + "Document", ns0 + "Folder"}
+    elements = []
+    for event, element in XML.iterparse(fileHandler, events=("start", "end")):
+        if event == "start":
+            elements.append(element)
+            continue
+        elements.pop()
+        if [e.tag for e in elements] + [element.tag] == placemarkPath:
+            for coordinates in element.findall(coordinatesPath):
+                yield split_by_comma(coordinates.text)
+        if elements and elements[-1].tag in containers:
+            elements[-1].remove(element)
+
+
+with open('../Winter 2012-2013.kml') as fh:
+    coordinates = tuple(read_rows_kml_iterative(fh))
+
 ###########################################
 # Parsing a file at a higher level
 ###########################################
@@ -195,3 +242,124 @@ with urlopen("file:../Winter%202012-2013.kml") as fh:
         invert_coordinates(\
         read_rows_kml(fh)
                     )))))
+
+###########################################
+# Computing all the distances in one pass
+###########################################
+
+# Calling calc_haversine() once per leg converts every interior point 
+# twice, and pays for a Python function call for each leg. 
+# The calc_leg_distances() function takes the latitudes and longitudes 
+# of a whole trip as two contiguous arrays, and computes the distance 
+# of every leg at once. 
+# It uses NumPy when it's installed. Otherwise, it converts each point 
+# and computes each cos(lat) only once, in a single list comprehension, 
+# and returns an array('d'). 
+# Both follow calc_haversine() step by step, including the second 
+# radians() on the latitude difference, so the results match it.
+
+def to_arrays(points):
+    """Split (lat, lon) points into two arrays.
+
+    >>> to_arrays([(1.0, 2.0), (3.0, 4.0)])
+    (array('d', [1.0, 3.0]), array('d', [2.0, 4.0]))
+    """
+    lats, lons = array('d'), array('d')
+    for lat, lon in points:
+        lats.append(lat)
+        lons.append(lon)
+    return lats, lons
+
+
+def calc_leg_distances_numpy(lats, lons, R=NM):
+    lat = numpy.radians(numpy.asarray(lats, dtype=float))
+    lon = numpy.asarray(lons, dtype=float)
+    delta_lat = numpy.radians(lat[1:] - lat[:-1])
+    delta_lon = numpy.radians(lon[1:] - lon[:-1])
+    cos_lat = numpy.cos(lat)
+    a = (numpy.sin(delta_lat/2)**2 
+        + cos_lat[:-1]*cos_lat[1:]*numpy.sin(delta_lon/2)**2)
+    return R * (2*numpy.arcsin(numpy.sqrt(a)))
+
+
+def calc_leg_distances_array(lats, lons, R=NM):
+    lat = array('d', map(radians, lats))
+    cos_lat = array('d', map(cos, lat))
+    return array('d', [
+        2*R*asin(sqrt(
+            sin(radians(lat_2 - lat_1)/2)**2 
+            + cos_1*cos_2*sin(radians(lon_2 - lon_1)/2)**2
+            ))
+        for lat_1, lat_2, cos_1, cos_2, lon_1, lon_2 in zip(
+            lat, islice(lat, 1, None), 
+            cos_lat, islice(cos_lat, 1, None), 
+            lons, islice(lons, 1, None)
+            )
+        ])
+
+
+def calc_leg_distances(lats, lons, R=NM):
+    """The distance of each leg between consecutive points.
+
+    >>> lats, lons = to_arrays([(36.12, -86.67), (33.94, -118.40), (36.12, -86.67)])
+    >>> [round(d, 5) for d in calc_leg_distances(lats, lons, R=6372.8)]
+    [2876.70813, 2876.70813]
+    """
+    if numpy is not None:
+        return calc_leg_distances_numpy(lats, lons, R)
+    return calc_leg_distances_array(lats, lons, R)
+
+# The calc_haversines_batch() function gives the same legs as 
+# calc_haversines(create_pairs_iterative(points)), from a single 
+# call to calc_leg_distances():
+
+def calc_haversines_batch(points, R=NM):
+    points = tuple(points)
+    distances = calc_leg_distances(*to_arrays(points), R=R)
+    if numpy is not None:
+        distances = distances.tolist()
+    return (
+        (start, end, round(distance, 4))
+        for start, end, distance in zip(points, points[1:], distances)
+        )
+
+'''
+>>> with open('../Winter 2012-2013.kml') as fh:
+...     points = tuple(convert_to_float(read_rows_kml_iterative(fh)))
+>>> legs = tuple(calc_haversines_batch(points))
+'''
+
+###########################################
+# Sharing the trigonometry between legs
+###########################################
+
+# In calc_haversines(create_pairs_iterative(points)), every interior 
+# point is the end of one leg and the start of the next, so 
+# calc_haversine() computes its radians() and cos() twice. 
+# The calc_haversines_fused() function pairs up the points itself, 
+# and carries the converted latitude and its cosine from each leg 
+# into the next one. It yields the same legs, one at a time.
+
+def calc_haversines_fused(lat_lon_iterable, R=NM):
+    """The same legs as calc_haversines(create_pairs_iterative(...)).
+
+    >>> trip = [(36.12, -86.67), (33.94, -118.40), (36.12, -86.67)]
+    >>> list(calc_haversines_fused(iter(trip), R=6372.8)) == [
+    ...     (start, end, round(calc_haversine(start, end, R=6372.8), 4))
+    ...     for start, end in zip(trip, trip[1:])]
+    True
+    """
+    iterator = iter(lat_lon_iterable)
+    start = next(iterator, None)
+    if start is None:
+        return
+    lat_1 = radians(start[0])
+    cos_1 = cos(lat_1)
+    for end in iterator:
+        lat_2 = radians(end[0])
+        cos_2 = cos(lat_2)
+        delta_lat = radians(lat_2 - lat_1)
+        delta_lon = radians(end[1] - start[1])
+        a = sin(delta_lat/2)**2 + cos_1*cos_2*sin(delta_lon/2)**2
+        yield start, end, round(R * (2*asin(sqrt(a))), 4)
+        start, lat_1, cos_1 = end, lat_2, cos_2
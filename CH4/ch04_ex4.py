@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""Functional Python Programming
+
+Chapter 4, Example Set 4
+"""
+# pylint: disable=line-too-long,wrong-import-position
+
+###########################################
+# Imports
+###########################################
+
+import os, sys
+from array import array
+from collections import namedtuple
+from heapq import heappush, heapreplace
+from math import radians, sin, cos, sqrt, asin, pi
+
+rootRelativePath = '..'
+rootAbsolutePath = os.path.abspath(rootRelativePath)
+sys.path.append(rootAbsolutePath)
+
+from CH4.ch04_ex1 import NM, read_rows_kml_iterative, invert_coordinates, \
+    convert_to_float
+
+###########################################
+# A spatial index over the points of a trip
+###########################################
+
+'''
+Finding the points near a position means calling calc_haversine() for
+every point of the trip. That's fine for the 74 points of the Winter
+trip, but not for interactive queries on tracks of millions of points.
+
+The index is a k-d tree. Each (lat, lon) point becomes a vector on
+the unit sphere, so there's no special case at the poles or where
+the longitude wraps around from 180 to -180. Each node of the tree
+holds a range of points and the bounding box of their vectors, and
+a query skips every node whose box can't hold an answer.
+
+The points are stored once, in arrays, in the order of the tree.
+Each answer refers to a point by its position in the original
+sequence, so the point at position i is the start of leg i.
+
+The distances are measured along the great circle, from the straight
+line between the two vectors. They agree with the haversine formula,
+but not with calc_haversine() when the latitudes differ, because it
+converts the latitude difference to radians twice.
+'''
+
+#---------------
+# Building the index
+#---------------
+
+def to_unit_vector(lat, lon):
+    """The point on the unit sphere at lat, lon.
+
+    >>> [round(c, 6) for c in to_unit_vector(90, 0)]
+    [0.0, 0.0, 1.0]
+    """
+    lat, lon = radians(lat), radians(lon)
+    return cos(lat)*cos(lon), cos(lat)*sin(lon), sin(lat)
+
+# Each node is a tuple (start, stop, left, right, low, high).
+# A leaf has -1 for left and right. The box of a leaf comes from its
+# points, and the box of a node from the boxes of its children.
+# A node is split along the axis where a sample of its points
+# is most spread out:
+
+PointIndex = namedtuple(
+    'PointIndex', ['lats', 'lons', 'coords', 'positions', 'nodes']
+    )
+
+def spread_axis(coords, sample):
+    values = [[axis[i] for i in sample] for axis in coords]
+    return max(range(3), key=lambda a: max(values[a]) - min(values[a]))
+
+def build_nodes(coords, order, start, stop, nodes, leaf_size):
+    node = len(nodes)
+    nodes.append(None)
+    if stop - start <= leaf_size:
+        values = [[axis[i] for i in order[start:stop]] for axis in coords]
+        nodes[node] = (start, stop, -1, -1, tuple(map(min, values)), tuple(map(max, values)))
+        return node
+    sample = order[start:stop:max(1, (stop-start)//256)]
+    axis = coords[spread_axis(coords, sample)]
+    order[start:stop] = sorted(order[start:stop], key=axis.__getitem__)
+    middle = (start + stop)//2
+    left = build_nodes(coords, order, start, middle, nodes, leaf_size)
+    right = build_nodes(coords, order, middle, stop, nodes, leaf_size)
+    low = tuple(map(min, nodes[left][4], nodes[right][4]))
+    high = tuple(map(max, nodes[left][5], nodes[right][5]))
+    nodes[node] = (start, stop, left, right, low, high)
+    return node
+
+def build_point_index(points, leaf_size=16):
+    points = tuple(points)
+    vectors = [to_unit_vector(lat, lon) for lat, lon in points]
+    coords = tuple(array('d', (v[axis] for v in vectors)) for axis in range(3))
+    order = list(range(len(points)))
+    nodes = []
+    if points:
+        build_nodes(coords, order, 0, len(points), nodes, leaf_size)
+    return PointIndex(
+        lats = array('d', (points[i][0] for i in order)),
+        lons = array('d', (points[i][1] for i in order)),
+        coords = tuple(array('d', (axis[i] for i in order)) for axis in coords),
+        positions = array('q', order),
+        nodes = nodes
+        )
+
+#---------------
+# Distances on the unit sphere
+#---------------
+
+# The squared length of the straight line between two vectors,
+# and the shortest one from a vector to a box:
+
+def chord2(index, i, q):
+    x, y, z = index.coords
+    return (x[i]-q[0])**2 + (y[i]-q[1])**2 + (z[i]-q[2])**2
+
+def box_chord2(q, low, high):
+    total = 0.0
+    for c, l, h in zip(q, low, high):
+        if c < l:
+            total += (l-c)**2
+        elif c > h:
+            total += (c-h)**2
+    return total
+
+def chord_to_distance(d2, R=NM):
+    return R * 2*asin(min(1.0, sqrt(d2)/2))
+
+def distance_to_chord(distance, R=NM):
+    if distance >= pi*R:
+        return 2.0
+    return 2*sin(distance/(2*R))
+
+#---------------
+# Querying the index
+#---------------
+
+Neighbor = namedtuple('Neighbor', ['distance', 'position'])
+
+# The nearest() function visits the nearer child first, so the k best
+# points found so far soon rule out most of the tree:
+
+def nearest(index, lat, lon, k=1, R=NM):
+    """The k points closest to lat, lon, nearest first."""
+    q = to_unit_vector(lat, lon)
+    best = []
+    stack = [0] if index.nodes and k > 0 else []
+    while stack:
+        start, stop, left, right, low, high = index.nodes[stack.pop()]
+        if len(best) == k and box_chord2(q, low, high) >= -best[0][0]:
+            continue
+        if left < 0:
+            for i in range(start, stop):
+                d2 = chord2(index, i, q)
+                if len(best) < k:
+                    heappush(best, (-d2, i))
+                elif d2 < -best[0][0]:
+                    heapreplace(best, (-d2, i))
+            continue
+        children = sorted(
+            (left, right),
+            key=lambda n: box_chord2(q, *index.nodes[n][4:])
+            )
+        stack.extend(reversed(children))
+    return [
+        Neighbor(chord_to_distance(-d2, R), index.positions[i])
+        for d2, i in sorted(best, reverse=True)
+        ]
+
+def within(index, lat, lon, distance, R=NM):
+    """The points no further than distance from lat, lon, nearest first."""
+    q = to_unit_vector(lat, lon)
+    limit = distance_to_chord(distance, R)**2
+    found = []
+    stack = [0] if index.nodes else []
+    while stack:
+        start, stop, left, right, low, high = index.nodes[stack.pop()]
+        if box_chord2(q, low, high) > limit:
+            continue
+        if left < 0:
+            found.extend(
+                (d2, i)
+                for d2, i in ((chord2(index, i, q), i) for i in range(start, stop))
+                if d2 <= limit
+                )
+            continue
+        stack.extend((left, right))
+    return [
+        Neighbor(chord_to_distance(d2, R), index.positions[i])
+        for d2, i in sorted(found)
+        ]
+
+# A box of latitudes and longitudes isn't a box of vectors, so
+# the query uses the smallest box of vectors that holds it, and then
+# checks each point in the nodes it reaches. A box with west > east
+# crosses the 180 meridian:
+
+def lon_ranges(west, east):
+    if west <= east:
+        return [(west, east)]
+    return [(west, 180.0), (-180.0, east)]
+
+def vector_bounds(south, north, west, east):
+    south, north = max(south, -90.0), min(north, 90.0)
+    cos_lats = [cos(radians(south)), cos(radians(north))]
+    if south <= 0 <= north:
+        cos_lats.append(1.0)
+    lons = [
+        lon
+        for low, high in lon_ranges(west, east)
+        for lon in [low, high] + [a for a in (-180, -90, 0, 90, 180) if low < a < high]
+        ]
+    cos_lons = [cos(radians(lon)) for lon in lons]
+    sin_lons = [sin(radians(lon)) for lon in lons]
+    cos_lats = (min(cos_lats), max(cos_lats))
+    xs = [c*u for c in cos_lats for u in (min(cos_lons), max(cos_lons))]
+    ys = [c*v for c in cos_lats for v in (min(sin_lons), max(sin_lons))]
+    epsilon = 1e-12
+    low = (min(xs)-epsilon, min(ys)-epsilon, sin(radians(south))-epsilon)
+    high = (max(xs)+epsilon, max(ys)+epsilon, sin(radians(north))+epsilon)
+    return low, high
+
+def in_box(index, south, north, west, east):
+    """The positions of the points with south <= lat <= north,
+    and a longitude from west to east, in their original order.
+    """
+    box_low, box_high = vector_bounds(south, north, west, east)
+    ranges = lon_ranges(west, east)
+    found = []
+    stack = [0] if index.nodes else []
+    while stack:
+        start, stop, left, right, low, high = index.nodes[stack.pop()]
+        if any(h < bl or l > bh for l, h, bl, bh in zip(low, high, box_low, box_high)):
+            continue
+        if left < 0:
+            found.extend(
+                index.positions[i]
+                for i in range(start, stop)
+                if south <= index.lats[i] <= north
+                and any(w <= index.lons[i] <= e for w, e in ranges)
+                )
+            continue
+        stack.extend((left, right))
+    return sorted(found)
+
+#---------------
+# Indexing the Winter trip
+#---------------
+
+with open('../Winter 2012-2013.kml') as fh:
+    points = tuple(\
+        convert_to_float(\
+        invert_coordinates(\
+        read_rows_kml_iterative(fh)
+        )))
+    pointIndex = build_point_index(points)
+
+# The closest waypoint to Norfolk, every waypoint within 5 nm of it,
+# and the waypoints in the Chesapeake Bay look like this:
+
+'''
+>>> nearest(pointIndex, 36.85, -76.29)
+>>> within(pointIndex, 36.85, -76.29, 5)
+>>> in_box(pointIndex, 36.9, 39.6, -77.4, -75.6)
+'''
@@ -4,8 +4,9 @@
 
 import os, sys
 import pprint
+from array import array
 from collections import namedtuple, defaultdict
-from collections.abc import Iterator
+from collections.abc import Iterator, Sequence
 from urllib.request import urlopen
 
 rootRelativePath = '..'
@@ -16,7 +17,7 @@ from CH3.ch03_ex4 import create_pairs, remove_headings, \
     read_rows
 from CH4.ch04_ex2 import calc_correlation
 from CH4.ch04_ex1 import calc_haversine, create_pairs_iterative, \
-    invert_coordinate, read_rows_kml
+    invert_coordinate, read_rows_kml, calc_leg_distances, to_arrays
 
 Pair = namedtuple("Pair", ("x", "y"))
 
@@ -90,6 +91,104 @@ with urlopen("file:../Winter%202012-2013.kml") as fh:
 
 pprint.pprint(trip)
 
+#-------------
+# A compact trip backed by arrays
+#-------------
+
+# A tuple of Leg namedtuples stores each point twice, as the end 
+# of one leg and the start of the next, and every float, Point and 
+# Leg is a separate object: around 300 bytes per leg.
+# The Trip class keeps the latitudes, the longitudes and the distances 
+# in three array('d') objects, which is 24 bytes per leg.
+# Indexing a Trip builds the Leg on demand, so get_start(), get_dist(), 
+# start_point() and the other selectors work on it unchanged.
+# Slicing a Trip with a step of 1 gives another Trip. A slice with 
+# any other step skips legs, so its legs don't share their points, 
+# and it gives a tuple of Legs.
+# Two Trips are equal when their arrays are equal.
+
+class Trip(Sequence):
+    __slots__ = ('lats', 'lons', 'distances')
+
+    def __init__(self, lats, lons, distances):
+        self.lats = array('d', lats)
+        self.lons = array('d', lons)
+        self.distances = array('d', distances)
+        points = len(self.distances)+1 if self.lats else 0
+        if len(self.lats) != points or len(self.lons) != points:
+            raise ValueError("a trip of n legs needs n+1 points")
+
+    @classmethod
+    def from_points(cls, points):
+        """Build the legs between consecutive (lat, lon) points.
+
+        >>> trip = Trip.from_points([(36.12, -86.67), (33.94, -118.40), (36.12, -86.67)])
+        >>> len(trip)
+        2
+        >>> trip[1]
+        Leg(start=Point(latitude=33.94, longitude=-118.4), end=Point(latitude=36.12, longitude=-86.67), distance=1552.8301)
+        """
+        lats, lons = to_arrays(points)
+        if not lats:
+            return cls((), (), ())
+        distances = (round(d, 4) for d in calc_leg_distances(lats, lons))
+        return cls(lats, lons, distances)
+
+    @classmethod
+    def from_legs(cls, legs):
+        lats, lons, distances = array('d'), array('d'), array('d')
+        end = None
+        for (lat, lon), end, distance in legs:
+            lats.append(lat)
+            lons.append(lon)
+            distances.append(distance)
+        if end is not None:
+            lats.append(end[0])
+            lons.append(end[1])
+        return cls(lats, lons, distances)
+
+    def point(self, index):
+        return Point(self.lats[index], self.lons[index])
+
+    def __len__(self):
+        return len(self.distances)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return tuple(self[i] for i in range(start, stop, step))
+            stop = max(start, stop)
+            return Trip(
+                self.lats[start:stop+1], self.lons[start:stop+1], 
+                self.distances[start:stop]
+                )
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("trip index out of range")
+        return Leg(self.point(index), self.point(index+1), self.distances[index])
+
+    def __eq__(self, other):
+        if not isinstance(other, Trip):
+            return NotImplemented
+        return (
+            self.lats == other.lats and self.lons == other.lons 
+            and self.distances == other.distances
+            )
+
+    def __repr__(self):
+        return "Trip(<{0} legs>)".format(len(self))
+
+# The same trip, with the points stored once:
+
+with urlopen("file:../Winter%202012-2013.kml") as fh:
+    compact_trip = Trip.from_points(convert_rows_to_float(read_rows_kml(fh)))
+
+tuple(compact_trip) == trip
+distance_nm(compact_trip[0])
+latitude_value(start_point(compact_trip[0]))
+
 ###########################################
 # Avoiding stateful classes by using families of tuples
 ###########################################